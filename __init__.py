@@ -1,95 +1,82 @@
 import json
-import requests
-import shutil
 import os
-import concurrent.futures
-import uuid
-import re
-import random
-from datetime import datetime
+import shutil
+from anki.collection import OpChanges
 from anki.hooks import addHook
+from anki.utils import ids2str
 from aqt.qt import *
-from aqt import mw
-from aqt.utils import showInfo
+from aqt import gui_hooks, mw
+from aqt.utils import askUser, showInfo
+
+from . import stats
+from .journal import Journal
 
 try:
     from .designer import form_qt6 as form
 except ImportError:
     from .designer import form_qt5 as form
 
-class SelectedSettings:
-    def __init__(self, source_field, min_length, exact, highlighting, tag, merge):
-        self.source_field = source_field
-        self.min_length = min_length
-        self.exact = exact
-        self.highlighting = highlighting
-        self.tag = tag
-        self.merge = merge
-
-
-def download_file(url, folder, file_extension):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_string = str(uuid.uuid4())[:8]
-        file_name = f"{current_time}_{random_string}.{file_extension}"
-        file_path = os.path.join(folder, file_name)
-        with open(file_path, "wb") as file:
-            shutil.copyfileobj(response.raw, file)
-        return file_path
-    else:
-        return None
-
-def get_context(_id):
-    url = f"https://api.immersionkit.com/sentence_with_context?id={_id}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        return {
-            "prev": data["pretext_sentences"][-1]["sentence"],
-            "next": data["posttext_sentences"][0]["sentence"],
-            "prev_furigana": data["pretext_sentences"][-1]["sentence_with_furigana"],
-            "next_furigana": data["posttext_sentences"][0]["sentence_with_furigana"]
-            }
-    
 
-def api_lookup(keyword, min_length=12, selected_exact=False, is_random=False):
-    if selected_exact:
-        url = f"https://api.immersionkit.com/look_up_dictionary?keyword=「{keyword}」&sort=shortness&min_length={min_length}"
-    else:
-        url = f"https://api.immersionkit.com/look_up_dictionary?keyword={keyword}&sort=shortness&min_length={min_length}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get("data"):
-            if not is_random:
-                example = data["data"][0]["examples"][0]
-            else:
-                try:
-                    example = random.choice(data["data"][0]["examples"])
-                except:
-                    return {"error": "No sentences is found for this settings"}
-            _id = example["id"]
-            context = get_context(_id)
-            return {
-                "sentence": example["sentence"],
-                "sentence_with_furigana": example["sentence_with_furigana"],
-                "translation": example["translation"],
-                "deck_name": example["deck_name"],
-                "audioURL": f"https://api.immersionkit.com/download_sentence_audio?id={example['id']}",
-                "imageURL": f"https://api.immersionkit.com/download_sentence_image?id={example['id']}",
-                "prev_text": context["prev"],
-                "next_text": context["next"],
-                "prev_text_furigana": context["prev_furigana"],
-                "next_text_furigana": context["next_furigana"]
-            }
-        else:
-            return {"error": "No data found for the keyword"}
-    else:
-        return {"error": "Failed to retrieve data from the API"}
+# core, engine and index pull in requests, asyncio and the image libraries,
+# so they are imported by the actions that need them rather than at startup.
+config_cache = None
+compiled_settings = None
+
+
+def current_config():
+    global config_cache
+    if config_cache is None:
+        config_cache = mw.addonManager.getConfig(__name__)
+    return config_cache
+
+
+def current_settings():
+    global compiled_settings
+    if compiled_settings is None:
+        from .engine import CompiledSettings, configure
+        compiled_settings = CompiledSettings(current_config())
+        configure(compiled_settings.config)
+    return compiled_settings
+
+
+def invalidate_settings(*args):
+    global config_cache, compiled_settings
+    config_cache = None
+    compiled_settings = None
+
+
+def import_dataset():
+    from .engine import configure_index, index_path
+    from .index import ExampleIndex
+
+    path, _ = QFileDialog.getOpenFileName(mw, "Import Immersion Kit Dataset", "", "JSON Lines (*.jsonl *.json)")
+    if not path:
+        return
+    index = ExampleIndex(index_path())
+
+    def task():
+        return index.import_jsonl(path, on_progress=lambda count: mw.taskman.run_on_main(
+            lambda: mw.progress.update(label=f"Indexed {count} examples")
+        ))
+
+    def finished(future):
+        index.close()
+        try:
+            count, skipped = future.result()
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            showInfo(f"An error occurred: {e}")
+            return
+        configure_index()
+        showInfo(f"Indexed {count} examples ({skipped} lines skipped).")
+
+    mw.taskman.with_progress(task, finished, label="Importing Immersion Kit dataset")
 
 
 def immersionKit(browser, ids):
+    from .batch import FetchPlan
+    from .core import SelectedSettings
+
     mw = browser.mw
 
     d = QDialog(browser)
@@ -113,6 +100,8 @@ def immersionKit(browser, ids):
     frm.highlightingCheckBox.setChecked(config.get("Highlighting", False))
     frm.sourceMediaTagCheckBox.setChecked(config.get("Tag", False))
     frm.mergeCheckbox.setChecked(config.get("Merge", False))
+    frm.incrementalCheckBox.setChecked(config.get("Incremental", False))
+    frm.engineField.setCurrentText(config.get("Engine", "Threads"))
 
     
     addon_folder = os.path.dirname(__file__)
@@ -170,10 +159,14 @@ def immersionKit(browser, ids):
             "ExactSearch": frm.exactSearchCheckBox.isChecked(), 
             "Highlighting": frm.highlightingCheckBox.isChecked(),
             "Tag": frm.sourceMediaTagCheckBox.isChecked(),
-            "Merge": frm.mergeCheckbox.isChecked()
+            "Merge": frm.mergeCheckbox.isChecked(),
+            "Incremental": frm.incrementalCheckBox.isChecked(),
+            "Engine": frm.engineField.currentText()
         }
 
-        mw.addonManager.writeConfig(__name__, meta_data)
+        config.update(meta_data)
+        mw.addonManager.writeConfig(__name__, config)
+        invalidate_settings()
 
         selected = SelectedSettings(
             frm.srcField.currentText(),
@@ -181,162 +174,250 @@ def immersionKit(browser, ids):
             frm.exactSearchCheckBox.isChecked(),
             frm.highlightingCheckBox.isChecked(),
             frm.sourceMediaTagCheckBox.isChecked(),
-            frm.mergeCheckbox.isChecked()
+            frm.mergeCheckbox.isChecked(),
+            frm.incrementalCheckBox.isChecked(),
+            config["Delimiter"]
         )
         _append_checkboxes = {name: append.isChecked() for name, append in zip(field_values.keys(), append_checkboxes)}
+        field_values = {name: combobox.currentText() for name, combobox in field_values.items()}
     else:
         return
 
+    if not FetchPlan(field_values, selected).lookup:
+        showInfo("No target fields are selected.")
+        return
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        progress = QProgressDialog('Importing from Immersion Kit', 'Cancel', 0, len(ids))
-        bar = QProgressBar(progress)
-        bar.setFormat('%v/%m')
-        bar.setMaximum(len(ids))
-        progress.setBar(bar)
-        progress.setMinimumDuration(1000)
-        progress.setModal(True)
-        counter = 0
-        for nid in ids:
-            futures.append(executor.submit(process_note, nid, field_values, selected, _append_checkboxes))
-
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-                counter += 1
-                progress.setValue(counter)
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                counter += 1
-                progress.setValue(counter)
-            if progress.wasCanceled():
-                break
-    mw.reset()
-    QMessageBox.information(None, "Done", "Done Updating!")
-
-def update_field(note, field, value, trigger_mode, append=False):
-    if trigger_mode:
-        field = field.currentText()
-    if field != "<ignored>":
-        if append:
-            note[field] += " " + value
-        else:
-            note[field] = value
-
-
-def update_note(note, field_values, api_response, selected, mode, keyword, append_checkboxes):
-    if "error" not in api_response:
-        sentence = fix_sentence(api_response["sentence"], keyword, False, selected.highlighting)
-        sentence_with_furigana = fix_sentence(api_response["sentence_with_furigana"], keyword, True, selected.highlighting)
-        translation = api_response["translation"]
-        audio_url = api_response["audioURL"]
-        image_url = api_response["imageURL"]
-        source = api_response["deck_name"]
-        _prev = api_response["prev_text"]
-        _next = api_response["next_text"]
-        _prev_furigana = api_response["prev_text_furigana"]
-        _next_furigana = api_response["next_text_furigana"]
-
-        audio_path = download_file(audio_url, mw.col.media.dir(), "mp3")
-        if audio_path:
-            update_field(note, field_values["Audio"], f'[sound:{os.path.basename(audio_path)}]', mode, append_checkboxes["Audio"])
-
-        image_path = download_file(image_url, mw.col.media.dir(), "png")
-        if image_path:
-            update_field(note, field_values["Image"], f'<img src="{os.path.basename(image_path)}">', mode, append_checkboxes["Image"])
-
-        if not selected.merge:
-            update_field(note, field_values["Sentence"], sentence, mode, append_checkboxes["Sentence"])
-            update_field(note, field_values["Sentence With Furigana"], sentence_with_furigana, mode,append_checkboxes["Sentence With Furigana"])
-        else:
-            update_field(note, field_values["Sentence"], "<small>" + _prev + "</small><br><big> " + sentence + " </big><br><small>" + _next + "</small>", mode, append_checkboxes["Sentence"])
-            update_field(note, field_values["Sentence With Furigana"], "<small>" + _prev_furigana + "</small><br><big> " + sentence_with_furigana + " </big><br><small>" + _next_furigana + "</small>", mode, append_checkboxes["Sentence With Furigana"])
-        update_field(note, field_values["English Translation"], translation, mode, append_checkboxes["English Translation"])
-        update_field(note, field_values["Source Media"], source, mode, append_checkboxes["Source Media"])
-        update_field(note, field_values["Previous Sentence"], _prev, mode, append_checkboxes["Previous Sentence"])
-        update_field(note, field_values["Next Sentence"], _next, mode, append_checkboxes["Next Sentence"])
-        if selected.tag:
-            tag = source.replace(" ", "::")
-            note.addTag(tag)
-
-
-def process_note(nid, field_values, selected, append_checkboxes):
-    note = mw.col.getNote(nid)
-    keyword = note[selected.source_field]
-    api_response = api_lookup(keyword, selected.min_length, selected.exact)
-    update_note(note, field_values, api_response, selected, True, keyword, append_checkboxes)
-    note.flush()
+    # Starting a journal would replace the one the running import writes to.
+    if check_import_running():
+        return
+    settings = {"selected": vars(selected), "field_values": field_values, "append": _append_checkboxes}
+    journal = Journal.start(journal_path(), settings, ids)
+    run_batch(ids, selected, field_values, _append_checkboxes, config, journal)
 
-def on_reroll_immersion_kit_key_press(_browser):
-    if _browser is None:
-        card = mw.reviewer.card
-        note_id = card.nid
-    else:
-        note_id = _browser.selectedNotes()[0]
 
-    note = mw.col.getNote(note_id)
+def journal_path():
+    return os.path.join(os.path.dirname(__file__), "user_files", "job.jsonl")
 
-    
-    config = mw.addonManager.getConfig(__name__)
-    selected = SelectedSettings(
-        config.get("Source Field", "Front"),
-        config.get("MinURLLength", 12),
-        config.get("ExactSearch", False),
-        config.get("Highlighting", False),
-        config.get("Tag", False),
-        config.get("Merge", False)
-    )
-    keyword = note[selected.source_field]
 
-    field_values = {}
+def prefetch_dir():
+    return os.path.join(os.path.dirname(__file__), "user_files", "prefetch")
 
-    addon_folder = os.path.dirname(__file__)
-    fields_path = os.path.join(addon_folder, 'fields.json')
 
-    with open(fields_path, 'r') as file:
-        fields_data = json.load(file)
+def resume_job(journal):
+    from .core import SelectedSettings
 
-    append_checkboxes = {}
+    existing = set(mw.col.db.list(f"select id from notes where id in {ids2str(journal.remaining())}"))
+    # Notes deleted since, or a job from another profile, can never be
+    # updated here; without this the prompt would come back every time.
+    vanished = [nid for nid in journal.remaining() if nid not in existing]
+    if vanished:
+        journal.record(permanent=vanished)
+    remaining = journal.remaining()
+    if not remaining:
+        journal.finish()
+        return
 
-    for i in range(len(fields_data["Search Queries"])):
-        name = fields_data["Search Queries"][i]["Name"]
+    config = current_config()
+    settings = journal.settings
+    selected = SelectedSettings(**settings["selected"])
+    journal = Journal.start(journal_path(), settings, remaining)
+    run_batch(remaining, selected, settings["field_values"], settings["append"], config, journal)
+
+
+class ImportSignals(QObject):
+    progress = pyqtSignal(int)
+    written = pyqtSignal()
+
+
+import_running = False
+
+
+def check_import_running():
+    if import_running:
+        showInfo("An Immersion Kit import is already running.")
+    return import_running
+
+
+def refresh_notes():
+    # Let the browser, reviewer and editor refresh whatever they show instead
+    # of rebuilding every screen with mw.reset().
+    gui_hooks.operation_did_execute(OpChanges(note_text=True, browser_table=True, tag=True), None)
+
+
+def run_batch(ids, selected, field_values, append_checkboxes, config, journal):
+    from .engine import Job, configure
+
+    global import_running
+    if check_import_running():
+        return
+    import_running = True
+
+    cache = configure(config)
+    cache.reset_stats()
+    run_stats = stats.start_run()
+
+    progress = QProgressDialog('Importing from Immersion Kit', 'Cancel', 0, len(ids), mw)
+    bar = QProgressBar(progress)
+    bar.setFormat('%v/%m')
+    bar.setMaximum(len(ids))
+    progress.setBar(bar)
+    progress.setMinimumDuration(1000)
+    progress.setModal(False)
+
+    signals = ImportSignals()
+    signals.progress.connect(progress.setValue)
+    signals.written.connect(refresh_notes)
+    job = Job(mw.col, ids, selected, field_values, append_checkboxes, config, journal, signals.progress.emit, signals.written.emit)
+    progress.canceled.connect(job.cancel)
+
+    def finished(future):
+        global import_running
+        import_running = False
+        progress.reset()
         try:
-            fld = config["Search Queries"][i]["Field"]
-            append_checked = config["Search Queries"][i].get("Append", False)
-        except:
-            fld = ""
-            append_checked = False
+            future.result()
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        journal.finish()
+        run_stats.finish()
+        refresh_notes()
+        show_run_report(run_stats, cache, journal, len(job.skipped))
+
+    mw.taskman.run_in_background(job.run, finished)
+
+
+def show_run_report(run_stats, cache, journal, skipped=0):
+    summary = run_stats.summary()
+    summary["lookup_cache"] = {"hits": cache.hits, "misses": cache.misses}
+    report_path = os.path.join(os.path.dirname(__file__), "user_files", "last_run.json")
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+
+    box = QMessageBox(mw)
+    box.setWindowTitle("Done")
+    box.setIcon(QMessageBox.Icon.Information)
+    text = f"Done Updating!\n\nCache: {cache.hits} hits, {cache.misses} misses"
+    if skipped:
+        text += f"\nSkipped {skipped} notes that were already up to date."
+    remaining = len(journal.remaining())
+    if remaining:
+        text += f"\n\n{remaining} notes were not updated. Run Add Immersion Kit again to resume them."
+    box.setText(text)
+    box.setDetailedText(f"{run_stats.report()}\n\nSaved to {report_path}")
+    box.exec()
+
+
+def reroll_key(nid, keyword, selected, plan):
+    return (nid, keyword, selected.min_length, selected.exact, selected.delimiter, plan.context, plan.audio, plan.image)
+
+
+prefetcher = None
+
+
+def get_prefetcher(config):
+    global prefetcher
+    if prefetcher is None:
+        from .core import discard_reroll_candidate, fetch_reroll_candidate
+        from .prefetch import Prefetcher
+        # Files left behind by a previous session were never used.
+        shutil.rmtree(prefetch_dir(), ignore_errors=True)
+        os.makedirs(prefetch_dir(), exist_ok=True)
+        prefetcher = Prefetcher(fetch_reroll_candidate, discard=discard_reroll_candidate)
+    prefetcher.depth = config.get("PrefetchCandidates", 2)
+    prefetcher.max_notes = config.get("PrefetchCards", 3) + 2
+    return prefetcher
+
+
+def upcoming_note_ids(count):
+    try:
+        queued = mw.col.sched.get_queued_cards(fetch_limit=count)
+    except Exception:
+        return []
+    return [queued_card.card.note_id for queued_card in queued.cards]
+
+
+def prefetch_rerolls(card):
+    from .batch import normalize_keyword
+
+    config = current_config()
+    if not config.get("PrefetchCandidates", 2):
+        return
+    settings = current_settings()
+    selected, plan = settings.selected, settings.plan
+    if not plan.lookup:
+        return
 
-        field_values[name] = fld
-        append_checkboxes[name] = append_checked
+    media_dir = prefetch_dir()
+    queue = get_prefetcher(config)
+    keys = []
+    for nid in dict.fromkeys([card.nid] + upcoming_note_ids(config.get("PrefetchCards", 3))):
+        note = mw.col.getNote(nid)
+        if selected.source_field not in note:
+            continue
+        keyword = normalize_keyword(note[selected.source_field])
+        key = reroll_key(nid, keyword, selected, plan)
+        queue.want(key, keyword, selected, plan, media_dir)
+        keys.append(key)
+    queue.keep(keys)
 
-    api_response = api_lookup(keyword, selected.min_length, selected.exact, True)
-    
-    update_note(note, field_values, api_response, selected, False, keyword, append_checkboxes)
 
-    mw.col.update_note(note)
+def stop_prefetching():
+    global prefetcher
+    if prefetcher is not None:
+        prefetcher.shutdown()
+        prefetcher = None
+
 
+def on_reroll_immersion_kit_key_press(_browser):
     if _browser is None:
-        mw.reviewer._redraw_current_card()
+        card = mw.reviewer.card
+        note_id = card.nid
     else:
-        mw.reset()
+        note_id = _browser.selectedNotes()[0]
+
+    note = mw.col.getNote(note_id)
 
+    from .batch import normalize_keyword
+    from .core import adopt_reroll_candidate, fetch_reroll_candidate, update_group
 
-def fix_sentence(sentence, keyword, setting, selected_highlighting):
-    sentence = re.sub(r'[　→]', '', sentence)
-    if selected_highlighting:
-        keyword_pattern = re.escape(keyword)
-        keyword_with_reading_pattern = rf'{keyword_pattern}\[(.*?)\]'
-        if setting:
-            sentence = re.sub(keyword_with_reading_pattern, r'<b>\g<0></b>', sentence)
-        else:
-            sentence = re.sub(keyword_pattern, f'<b>{keyword}</b>', sentence)
-    return sentence
+    settings = current_settings()
+    config = settings.config
+    selected, field_values, append_checkboxes, plan = settings.selected, settings.field_values, settings.append_checkboxes, settings.plan
+    if not plan.lookup:
+        return
+    keyword = normalize_keyword(note[selected.source_field])
+
+    media_dir = mw.col.media.dir()
+    key = reroll_key(note_id, keyword, selected, plan)
+    candidate = get_prefetcher(config).take(key, keyword, selected, plan, prefetch_dir())
+    if candidate is not None:
+        candidate = adopt_reroll_candidate(candidate, media_dir)
+    if candidate is None:
+        candidate = fetch_reroll_candidate(keyword, selected, plan, media_dir)
+    if candidate is None:
+        return
+    responses, media = candidate
+    update_group(field_values, responses, selected, keyword, append_checkboxes, media).apply(note)
 
+    mw.col.update_note(note)
+
+    if _browser is None:
+        mw.reviewer._redraw_current_card()
+    else:
+        mw.reset()
 
 
 def onAddFields(browser):
+    if check_import_running():
+        return
+    journal = Journal.load(journal_path())
+    if journal is not None and journal.remaining():
+        question = f"An unfinished Immersion Kit import has {len(journal.remaining())} of {len(journal.nids)} notes left. Resume it?"
+        if askUser(question, parent=browser):
+            resume_job(journal)
+            return
+
     nids = browser.selectedNotes()
     if not nids:
         return
@@ -358,6 +439,9 @@ def setupMenu(browser):
 
 
 addHook("browser.setupMenus", setupMenu)
+gui_hooks.reviewer_did_show_question.append(prefetch_rerolls)
+gui_hooks.profile_will_close.append(stop_prefetching)
+mw.addonManager.setConfigUpdatedAction(__name__, invalidate_settings)
 
 reroll_immersion_kit_action = QAction('Get new example sentence', mw)
 reroll_immersion_kit_shortcut = QKeySequence("Ctrl+K")
@@ -365,3 +449,6 @@ reroll_immersion_kit_action.setShortcut(reroll_immersion_kit_shortcut)
 reroll_immersion_kit_action.triggered.connect(lambda: on_reroll_immersion_kit_key_press(None))
 mw.form.menuTools.addAction(reroll_immersion_kit_action)
 
+import_dataset_action = QAction('Import Immersion Kit Dataset...', mw)
+import_dataset_action.triggered.connect(import_dataset)
+mw.form.menuTools.addAction(import_dataset_action)
@@ -0,0 +1,204 @@
+import concurrent.futures
+import hashlib
+import html
+import json
+import re
+import threading
+import unicodedata
+
+from . import stats
+
+
+tag_pattern = re.compile(r"<[^>]+>")
+
+
+def normalize_keyword(text):
+    text = tag_pattern.sub("", text)
+    text = html.unescape(text)
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+def split_keywords(keyword, delimiter):
+    if not delimiter:
+        return [keyword]
+    delimiter = unicodedata.normalize("NFKC", delimiter)
+    parts = keyword.split() if delimiter.isspace() else keyword.split(delimiter)
+    keywords = list(dict.fromkeys(part.strip() for part in parts if part.strip()))
+    return keywords or [keyword]
+
+
+def group_by_keyword(keywords):
+    groups = {}
+    for nid, keyword in keywords:
+        groups.setdefault(normalize_keyword(keyword), []).append(nid)
+    return groups
+
+
+# Earlier versions kept the fingerprint in a tag on the note.
+fingerprint_tag = re.compile(r"immersionkit::[0-9a-f]{12}", re.IGNORECASE)
+
+
+def fingerprint(keyword, selected, field_values, append_checkboxes):
+    settings = [
+        keyword, selected.min_length, selected.exact, selected.highlighting, selected.tag, selected.merge,
+        selected.delimiter, field_values, append_checkboxes
+    ]
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def is_up_to_date(note, stored, keyword, selected, field_values, append_checkboxes):
+    if stored != fingerprint(keyword, selected, field_values, append_checkboxes):
+        return False
+    targets = [field for field in field_values.values() if field and field != "<ignored>"]
+    return all(field in note and note[field].strip() for field in targets)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = concurrent.futures.Future()
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class FetchPlan:
+    def __init__(self, field_values, selected):
+        def mapped(name):
+            field = field_values.get(name)
+            return bool(field) and field != "<ignored>"
+
+        sentences = mapped("Sentence") or mapped("Sentence With Furigana")
+        self.context = mapped("Previous Sentence") or mapped("Next Sentence") or (selected.merge and sentences)
+        self.audio = mapped("Audio")
+        self.image = mapped("Image")
+        self.lookup = (
+            sentences or self.context or self.audio or self.image
+            or mapped("English Translation") or mapped("Source Media") or selected.tag
+        )
+
+
+class NoteUpdate:
+    def __init__(self):
+        self.fields = []
+        self.tags = []
+        self.fingerprint = None
+        self.error = None
+        self.permanent = False
+
+    def set_field(self, field, value, append=False):
+        if field and field != "<ignored>":
+            self.fields.append((field, value, append))
+
+    def add_tag(self, tag):
+        self.tags.append(tag)
+
+    @classmethod
+    def combine(cls, updates, separator="<br>"):
+        # Values written to the same field by different examples are joined,
+        # matching each update's nth write to a field with the others' nth.
+        combined = cls()
+        values = {}
+        for update in updates:
+            seen = {}
+            for field, value, append in update.fields:
+                key = (field, seen.get(field, 0))
+                seen[field] = key[1] + 1
+                if key not in values:
+                    values[key] = ([], append)
+                    combined.fields.append(key)
+                if value not in values[key][0]:
+                    values[key][0].append(value)
+            for tag in update.tags:
+                if tag not in combined.tags:
+                    combined.tags.append(tag)
+        combined.fields = [(key[0], separator.join(values[key][0]), values[key][1]) for key in combined.fields]
+        combined.fingerprint = updates[0].fingerprint
+        return combined
+
+    def apply(self, note):
+        for field, value, append in self.fields:
+            if append:
+                note[field] += " " + value
+            else:
+                note[field] = value
+        note.tags = [tag for tag in note.tags if not fingerprint_tag.fullmatch(tag)]
+        for tag in self.tags:
+            note.add_tag(tag)
+
+
+class NoteWriter:
+    def __init__(self, col, chunk_size=200, undo_name="Add Immersion Kit", journal=None, on_flush=None, fingerprints=None):
+        self.col = col
+        self.journal = journal
+        self.fingerprints = fingerprints
+        self.on_flush = on_flush
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.written = 0
+        self.failed = []
+        self.undo_name = undo_name
+        self.undo_entry = col.add_custom_undo_entry(undo_name)
+
+    def add(self, nids, update):
+        self.pending.extend((nid, update) for nid in nids)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        nids = []
+        failed = []
+        fingerprints = []
+        with stats.stage("write"):
+            notes = []
+            for nid, update in pending:
+                # One note whose type lacks a mapped field must not cost the
+                # rest of the chunk.
+                try:
+                    note = self.col.get_note(nid)
+                    update.apply(note)
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+                    failed.append(nid)
+                    continue
+                nids.append(nid)
+                notes.append(note)
+                fingerprints.append((nid, update.fingerprint))
+            # Fold every chunk into one entry so the whole batch is undone in
+            # one step, unless the user has done something else in between.
+            if notes:
+                if self.col.undo_status().last_step != self.undo_entry:
+                    self.undo_entry = self.col.add_custom_undo_entry(self.undo_name)
+                self.col.update_notes(notes)
+                self.col.merge_undo_entries(self.undo_entry)
+                self.written += len(notes)
+                if self.fingerprints is not None:
+                    self.fingerprints.update(self.col.path, fingerprints)
+        self.failed.extend(failed)
+        if self.journal is not None:
+            self.journal.record(completed=nids, permanent=failed)
+        if self.on_flush is not None:
+            self.on_flush()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+
+class FakeNote(dict):
+    def __init__(self, nid, fields):
+        super().__init__(fields)
+        self.id = nid
+        self.tags = []
+
+    def add_tag(self, tag):
+        if tag not in self.tags:
+            self.tags.append(tag)
+
+
+class FakeMedia:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def dir(self):
+        return self.folder
+
+
+class FakeUndoStatus:
+    def __init__(self, last_step):
+        self.last_step = last_step
+
+
+class FakeCollection:
+    def __init__(self, keywords, media_dir=None):
+        self.notes = {
+            nid: FakeNote(nid, {"Front": keyword, "Sentence": "", "Audio": "", "Image": "", "Translation": ""})
+            for nid, keyword in enumerate(keywords, 1)
+        }
+        self.media = FakeMedia(media_dir or tempfile.mkdtemp(prefix="ik-bench-media-"))
+        self.writes = 0
+        self.undo_entries = 0
+
+    def get_note(self, nid):
+        return self.notes[nid]
+
+    getNote = get_note
+
+    def update_notes(self, notes):
+        self.writes += 1
+
+    def add_custom_undo_entry(self, name):
+        self.undo_entries += 1
+        return self.undo_entries
+
+    def merge_undo_entries(self, target):
+        pass
+
+    def undo_status(self):
+        return FakeUndoStatus(self.undo_entries)
+
+    def media_bytes(self):
+        folder = self.media.dir()
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
@@ -0,0 +1,132 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class MockSettings:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, examples=50, audio_bytes=30_000, image_bytes=100_000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.examples = examples
+        self.audio_bytes = audio_bytes
+        self.image_bytes = image_bytes
+
+
+def example(keyword, i):
+    sentence = f"{keyword}を{'とても' * (i % 7)}使った例文です"
+    return {
+        "id": f"{keyword}_{i}",
+        "sentence": sentence,
+        "sentence_with_furigana": sentence,
+        "translation": f"Example sentence {i} for {keyword}.",
+        "deck_name": f"Mock Show {i % 5}",
+        "author_japanese": "",
+        "tags": ["mock"],
+    }
+
+
+def context_sentence(_id, side):
+    return {"sentence": f"{side} of {_id}", "sentence_with_furigana": f"{side} of {_id}"}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        settings = self.server.settings
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.count(url.path)
+
+        time.sleep(max(0, random.gauss(settings.latency, settings.jitter)))
+        if random.random() < settings.error_rate:
+            self.send_body(503, b"", "text/plain", {"Retry-After": "0"})
+            return
+
+        if url.path == "/look_up_dictionary":
+            keyword = query.get("keyword", "").strip("「」")
+            examples = [example(keyword, i) for i in range(settings.examples)]
+            min_length = int(query.get("min_length", 0))
+            examples = [e for e in examples if len(e["sentence"]) >= min_length]
+            examples.sort(key=lambda e: len(e["sentence"]))
+            data = {"data": [{"examples": examples}]} if examples else {"data": []}
+            self.send_json(data)
+        elif url.path == "/sentence_with_context":
+            _id = query.get("id", "")
+            self.send_json({
+                "pretext_sentences": [context_sentence(_id, "before")],
+                "posttext_sentences": [context_sentence(_id, "after")],
+            })
+        elif url.path == "/download_sentence_audio":
+            self.send_body(200, b"\0" * settings.audio_bytes, "audio/mpeg")
+        elif url.path == "/download_sentence_image":
+            self.send_body(200, b"\0" * settings.image_bytes, "image/png")
+        else:
+            self.send_body(404, b"", "text/plain")
+
+    def send_json(self, data):
+        self.send_body(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, settings, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.settings = settings
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address):
+        # Cancelled imports drop their connections mid-body; that is expected.
+        pass
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Immersion Kit API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--examples", type=int, default=50)
+    args = parser.parse_args()
+
+    server = MockServer(MockSettings(args.latency, error_rate=args.error_rate, examples=args.examples), args.port)
+    print(f"Serving on {server.url}")
+    server.serve_forever()
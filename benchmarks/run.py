@@ -0,0 +1,161 @@
+import argparse
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+from fake_collection import FakeCollection
+from mock_server import MockServer, MockSettings
+
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_addon():
+    # Import the add-on's Qt-free modules without running its __init__,
+    # which needs a running Anki.
+    package = types.ModuleType("immersion_kit")
+    package.__path__ = [ADDON_DIR]
+    sys.modules["immersion_kit"] = package
+    return (
+        importlib.import_module("immersion_kit.core"),
+        importlib.import_module("immersion_kit.batch"),
+        importlib.import_module("immersion_kit.network"),
+        importlib.import_module("immersion_kit.stats"),
+    )
+
+
+core, batch, network, stats = load_addon()
+
+
+FIELD_VALUES = {
+    "Sentence": "Sentence",
+    "Sentence With Furigana": "<ignored>",
+    "Image": "Image",
+    "Audio": "Audio",
+    "English Translation": "Translation",
+    "Source Media": "<ignored>",
+    "Previous Sentence": "<ignored>",
+    "Next Sentence": "<ignored>",
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_once(server, notes, workers, engine, distinct, text_only, use_cache, measure_memory):
+    keywords = [f"単語{i % max(1, int(notes * distinct))}" for i in range(notes)]
+    col = FakeCollection(keywords)
+    cache_dir = tempfile.mkdtemp(prefix="ik-bench-cache-")
+
+    core.api_url = server.url
+    core.lookup_cache = None
+    if use_cache:
+        core.configure_cache(os.path.join(cache_dir, "cache.sqlite"), 3600, 100000)
+    network.configure(workers, 5, 30, workers)
+
+    field_values = dict(FIELD_VALUES)
+    if text_only:
+        field_values["Image"] = field_values["Audio"] = "<ignored>"
+    selected = core.SelectedSettings("Front", 0, False, False, False, False)
+    plan = batch.FetchPlan(field_values, selected)
+    append_checkboxes = {name: False for name in field_values}
+    groups = batch.group_by_keyword((nid, note["Front"]) for nid, note in col.notes.items())
+    writer = batch.NoteWriter(col, 200)
+    latencies = []
+
+    def on_done(nids, update, elapsed):
+        if update is not None:
+            writer.add(nids, update)
+        if elapsed is not None:
+            latencies.extend([elapsed] * len(nids))
+
+    run_stats = stats.start_run()
+    if measure_memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    if engine == "asyncio":
+        stage_workers = (max(1, workers // 2), max(1, workers // 2), workers)
+        core.run_pipelined(groups, field_values, selected, append_checkboxes, plan, col.media.dir(), stage_workers, on_done, lambda: False)
+    else:
+        core.run_threaded(groups, field_values, selected, append_checkboxes, plan, col.media.dir(), workers, on_done, lambda: False)
+    writer.flush()
+    elapsed = time.monotonic() - start
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {
+        "engine": engine,
+        "notes": notes,
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "notes_per_sec": round(notes / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "peak_mb": round(peak / 2 ** 20, 2),
+        "written": writer.written,
+        "media_mb": round(col.media_bytes() / 2 ** 20, 2),
+        "stages": run_stats.summary()["stages"],
+    }
+    shutil.rmtree(col.media.dir(), ignore_errors=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if core.lookup_cache is not None:
+        core.lookup_cache.close()
+        core.lookup_cache = None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure batch import throughput against a local mock Immersion Kit server.")
+    parser.add_argument("--notes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--engine", choices=["threads", "asyncio"], nargs="+", default=["threads", "asyncio"])
+    parser.add_argument("--latency", type=float, default=0.05, help="mean server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--examples", type=int, default=50, help="examples returned per lookup")
+    parser.add_argument("--audio-kb", type=int, default=30)
+    parser.add_argument("--image-kb", type=int, default=100)
+    parser.add_argument("--distinct", type=float, default=1.0, help="fraction of notes with a distinct keyword")
+    parser.add_argument("--text-only", action="store_true", help="map no audio or image fields")
+    parser.add_argument("--cache", action="store_true", help="use a fresh on-disk lookup cache")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows the run down")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.jitter, args.error_rate, args.examples, args.audio_kb * 1024, args.image_kb * 1024)
+    server = MockServer(settings).start()
+    results = []
+    columns = ["engine", "notes", "workers", "seconds", "notes_per_sec", "p50_ms", "p99_ms", "peak_mb", "written"]
+    print("  ".join(f"{column:>13}" for column in columns))
+    try:
+        for engine in args.engine:
+            for notes in args.notes:
+                for workers in args.workers:
+                    result = run_once(server, notes, workers, engine, args.distinct, args.text_only, args.cache, not args.no_memory)
+                    results.append(result)
+                    print("  ".join(f"{result[column]:>13}" for column in columns), flush=True)
+    finally:
+        server.stop()
+
+    print(f"Requests served: {json.dumps(server.requests)}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
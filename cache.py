@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LookupCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=50000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._puts += 1
+            # Evicting on every insert would turn each put into a table scan.
+            if self._puts % 100 == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        if self.max_entries:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def evict(self):
+        with self._lock:
+            self._evict(time.time())
+            self._conn.commit()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def lookup_key(keyword, min_length, exact, is_random=False):
+    mode = "sample" if is_random else "first"
+    return f"lookup:{mode}:{int(bool(exact))}:{min_length}:{keyword}"
+
+
+def context_key(_id):
+    return f"context:{_id}"
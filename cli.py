@@ -0,0 +1,146 @@
+import argparse
+import importlib
+import json
+import os
+import signal
+import sys
+import time
+import types
+
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_addon():
+    # Import the Qt-free modules as a package of their own; the add-on's
+    # __init__ needs a running Anki.
+    package = types.ModuleType("immersion_kit")
+    package.__path__ = [ADDON_DIR]
+    sys.modules["immersion_kit"] = package
+    return (
+        importlib.import_module("immersion_kit.engine"),
+        importlib.import_module("immersion_kit.journal"),
+        importlib.import_module("immersion_kit.stats"),
+    )
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+    # Settings changed in Anki's add-on config editor live in meta.json.
+    meta_path = os.path.join(os.path.dirname(path), "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as file:
+            config.update(json.load(file).get("config", {}))
+    return config
+
+
+def parse_fields(values, field_values):
+    for value in values:
+        name, _, field = value.partition("=")
+        if name not in field_values:
+            raise SystemExit(f"Unknown field {name!r}; expected one of {', '.join(field_values)}")
+        field_values[name] = field or "<ignored>"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add Immersion Kit examples to the notes of an Anki collection without opening Anki.")
+    parser.add_argument("collection", help="path to a .anki2 collection; close Anki first")
+    parser.add_argument("query", help="Anki search selecting the notes to update, e.g. 'deck:Mining'")
+    parser.add_argument("--field", action="append", default=[], metavar="NAME=FIELD",
+                        help="write NAME (e.g. Sentence, Audio, Image) to the note field FIELD; repeatable")
+    parser.add_argument("--append", action="append", default=[], metavar="NAME", help="append to NAME's field instead of replacing it")
+    parser.add_argument("--source-field", help="note field holding the keyword")
+    parser.add_argument("--min-length", type=int)
+    parser.add_argument("--exact", action="store_true", default=None)
+    parser.add_argument("--highlight", action="store_true", default=None)
+    parser.add_argument("--tag", action="store_true", default=None, help="tag notes with their source media")
+    parser.add_argument("--merge", action="store_true", default=None, help="merge the previous and next sentences into the sentence")
+    parser.add_argument("--incremental", action="store_true", default=None, help="skip notes that are already up to date")
+    parser.add_argument("--delimiter")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--engine", choices=["Threads", "Asyncio"])
+    parser.add_argument("--config", default=os.path.join(ADDON_DIR, "config.json"), help="add-on config to take defaults from")
+    parser.add_argument("--user-files", help="folder for the lookup cache, offline index and job journal")
+    parser.add_argument("--journal", help="job journal; an unfinished one is resumed instead of running the query")
+    parser.add_argument("--api-url", help="Immersion Kit API to use instead of the public one")
+    args = parser.parse_args()
+
+    from anki.collection import Collection
+
+    engine, journal_module, stats = load_addon()
+    if args.api_url:
+        engine.core.api_url = args.api_url.rstrip("/")
+    config = load_config(args.config)
+    for key, value in (("Workers", args.workers), ("Engine", args.engine)):
+        if value is not None:
+            config[key] = value
+    selected, field_values, append_checkboxes, _ = engine.settings_from_config(config)
+    for attribute, value in (
+        ("source_field", args.source_field), ("min_length", args.min_length), ("exact", args.exact),
+        ("highlighting", args.highlight), ("tag", args.tag), ("merge", args.merge),
+        ("incremental", args.incremental), ("delimiter", args.delimiter),
+    ):
+        if value is not None:
+            setattr(selected, attribute, value)
+    parse_fields(args.field, field_values)
+    for name in args.append:
+        append_checkboxes[name] = True
+
+    folder = args.user_files or engine.user_files
+    journal_path = args.journal or os.path.join(folder, "job-cli.jsonl")
+    cache = engine.configure(config, folder)
+    col = Collection(args.collection)
+    try:
+        journal = journal_module.Journal.load(journal_path) if args.journal else None
+        if journal is not None and journal.remaining():
+            ids = journal.remaining()
+            print(f"Resuming {len(ids)} of {len(journal.nids)} notes from {journal_path}", file=sys.stderr)
+            # Finish the job the way it was started, whatever the command line says now.
+            settings = journal.settings
+            selected = engine.SelectedSettings(**settings["selected"])
+            field_values = settings["field_values"]
+            append_checkboxes = settings["append"]
+        else:
+            ids = list(col.find_notes(args.query))
+            settings = {"selected": vars(selected), "field_values": field_values, "append": append_checkboxes}
+        journal = journal_module.Journal.start(journal_path, settings, ids)
+
+        total = len(ids)
+        last_report = 0
+
+        def on_progress(done):
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report >= 1 or done == total:
+                last_report = now
+                print(f"{done}/{total}", file=sys.stderr, flush=True)
+
+        run_stats = stats.start_run()
+        job = engine.Job(col, ids, selected, field_values, append_checkboxes, config, journal, on_progress)
+
+        def interrupt(*_):
+            # A second Ctrl+C stops without waiting for requests in flight.
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            print("Cancelling...", file=sys.stderr)
+            job.cancel()
+
+        signal.signal(signal.SIGINT, interrupt)
+        job.run()
+        journal.finish()
+        run_stats.finish()
+    finally:
+        col.close()
+
+    print(run_stats.report())
+    print(f"\nUpdated {job.writer.written}, skipped {len(job.skipped)}, failed {len(job.failed)}; "
+          f"cache {cache.hits} hits, {cache.misses} misses")
+    remaining = len(journal.remaining())
+    if remaining:
+        print(f"{remaining} notes were not updated. Run again with --journal {journal_path} to resume them.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,558 @@
+import concurrent.futures
+import itertools
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from . import images, jsonstream, network, stats
+from .highlight import clean_sentence, highlight
+from .batch import NoteUpdate, SingleFlight, fingerprint, split_keywords
+from .cache import LookupCache, lookup_key, context_key
+from .fingerprints import FingerprintStore
+from .index import ExampleIndex
+from .pipeline import Pipeline
+
+
+api_url = "https://api.immersionkit.com"
+lookup_cache = None
+lookup_cache_lock = threading.Lock()
+example_index = None
+example_fields = ("id", "sentence", "sentence_with_furigana", "translation", "deck_name")
+# Rerolls pick from a uniform sample of this many examples instead of
+# parsing every example the API returns.
+sample_size = 32
+# Largest look_up_dictionary body read to the end to keep its connection.
+drain_limit = 256 * 1024
+# Examples found during the current batch, so a sub-keyword shared by many
+# notes is looked up once even when the on-disk cache is off.
+run_examples = {}
+image_transcoder = None
+fingerprint_store = None
+lookup_flight = SingleFlight()
+
+
+class SelectedSettings:
+    def __init__(self, source_field, min_length, exact, highlighting, tag, merge, incremental=False, delimiter=""):
+        self.source_field = source_field
+        self.min_length = min_length
+        self.exact = exact
+        self.highlighting = highlighting
+        self.tag = tag
+        self.merge = merge
+        self.incremental = incremental
+        self.delimiter = delimiter
+
+
+unsafe_file_chars = re.compile(r"[^\w.-]")
+
+
+def media_file_name(_id, file_extension):
+    safe_id = unsafe_file_chars.sub("_", str(_id))
+    return f"immersionkit_{safe_id}.{file_extension}"
+
+
+def download_file(url, folder, file_name, sample=None):
+    sample = sample or stats.Sample()
+    file_path = os.path.join(folder, file_name)
+    sample.cache_hit = os.path.exists(file_path)
+    if sample.cache_hit:
+        return file_path
+    return lookup_flight.do(file_path, fetch_file, url, file_path, sample)
+
+
+def fetch_file(url, file_path, sample):
+    if os.path.exists(file_path):
+        return file_path
+    with network.get(url, stream=True) as response:
+        if response.status_code != 200:
+            sample.error = True
+            return None
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=os.path.dirname(file_path))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in response.iter_content(64 * 1024):
+                    if network.is_cancelled():
+                        raise network.Cancelled("Cancelled")
+                    file.write(chunk)
+            sample.bytes = os.path.getsize(temp_path)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    return file_path
+
+
+def configure_cache(path, ttl, max_entries):
+    global lookup_cache
+    with lookup_cache_lock:
+        if lookup_cache is None or lookup_cache.path != path:
+            lookup_cache = LookupCache(path, ttl, max_entries)
+        else:
+            lookup_cache.ttl = ttl
+            lookup_cache.max_entries = max_entries
+        return lookup_cache
+
+
+def configure_images(max_size, image_format, quality, workers):
+    global image_transcoder
+    # Shrinking without a format change keeps the API's PNGs.
+    if image_format == "original" and max_size:
+        image_format = "png"
+    with lookup_cache_lock:
+        settings = (max_size, image_format, quality, workers)
+        if image_transcoder is not None and image_transcoder.settings == settings:
+            return image_transcoder
+        if image_transcoder is not None:
+            image_transcoder.shutdown()
+            image_transcoder = None
+        if image_format not in images.formats or not images.available():
+            return None
+        image_transcoder = images.Transcoder(max_size, image_format, quality, workers)
+        return image_transcoder
+
+
+def configure_index(path):
+    global example_index
+    with lookup_cache_lock:
+        if not os.path.exists(path):
+            example_index = None
+        elif example_index is None or example_index.path != path:
+            example_index = ExampleIndex(path)
+        return example_index
+
+
+def configure_fingerprints(path):
+    global fingerprint_store
+    with lookup_cache_lock:
+        if fingerprint_store is None or fingerprint_store.path != path:
+            fingerprint_store = FingerprintStore(path)
+        return fingerprint_store
+
+
+def get_context(_id):
+    return lookup_flight.do(context_key(_id), fetch_context, _id)
+
+
+def fetch_context(_id):
+    with stats.stage("context") as sample:
+        index = example_index
+        if index is not None:
+            context = index.context(_id)
+            if context is not None:
+                sample.cache_hit = True
+                return context
+
+        cache = lookup_cache
+        key = context_key(_id)
+        if cache is not None:
+            context = cache.get(key)
+            sample.cache_hit = context is not None
+            if context is not None:
+                return context
+
+        url = f"{api_url}/sentence_with_context?id={_id}"
+        with network.get(url) as response:
+            if response.status_code != 200:
+                sample.error = True
+                return None
+            sample.bytes = len(response.content)
+            data = response.json()
+        context = {
+            "prev": data["pretext_sentences"][-1]["sentence"],
+            "next": data["posttext_sentences"][0]["sentence"],
+            "prev_furigana": data["pretext_sentences"][-1]["sentence_with_furigana"],
+            "next_furigana": data["posttext_sentences"][0]["sentence_with_furigana"]
+            }
+        if cache is not None:
+            cache.put(key, context)
+        return context
+
+
+def lookup_examples(keyword, min_length=12, selected_exact=False, is_random=False):
+    key = lookup_key(keyword, min_length, selected_exact, is_random)
+    if is_random:
+        return lookup_flight.do(key, fetch_examples, keyword, min_length, selected_exact, is_random)
+    examples = run_examples.get(key)
+    if examples is None:
+        examples = lookup_flight.do(key, fetch_examples, keyword, min_length, selected_exact, is_random)
+        if examples is not None:
+            run_examples[key] = examples
+    return examples
+
+
+def fetch_examples(keyword, min_length=12, selected_exact=False, is_random=False):
+    with stats.stage("lookup") as sample:
+        index = example_index
+        if index is not None:
+            examples = index.lookup(keyword, min_length)
+            if examples:
+                sample.cache_hit = True
+                return examples
+
+        cache = lookup_cache
+        key = lookup_key(keyword, min_length, selected_exact, is_random)
+        if cache is not None:
+            examples = cache.get(key)
+            sample.cache_hit = examples is not None
+            if examples is not None:
+                return examples
+
+        if selected_exact:
+            url = f"{api_url}/look_up_dictionary?keyword=「{keyword}」&sort=shortness&min_length={min_length}"
+        else:
+            url = f"{api_url}/look_up_dictionary?keyword={keyword}&sort=shortness&min_length={min_length}"
+        with network.get(url, stream=True) as response:
+            if response.status_code != 200:
+                sample.error = True
+                return None
+
+            def chunks():
+                for chunk in response.iter_content(16 * 1024):
+                    sample.bytes += len(chunk)
+                    yield chunk
+
+            # Examples arrive shortest first, so the first one is all a
+            # normal lookup needs and it is parsed as soon as it arrives.
+            stream = chunks()
+            examples = (
+                {field: example[field] for field in example_fields}
+                for example in jsonstream.iter_array(stream, "examples")
+            )
+            if is_random:
+                examples = jsonstream.reservoir(examples, sample_size)
+            else:
+                examples = jsonstream.first(examples)
+                # Closing a response early also closes its connection, and a
+                # new TLS handshake costs more than reading a small body to
+                # the end. Only large bodies are cut short.
+                length = response.headers.get("Content-Length")
+                if length is not None and length.isdigit() and int(length) <= drain_limit:
+                    for _ in stream:
+                        pass
+        if cache is not None:
+            cache.put(key, examples)
+        return examples
+
+
+def find_example(keyword, min_length=12, selected_exact=False, is_random=False):
+    examples = lookup_examples(keyword, min_length, selected_exact, is_random)
+    if examples is None:
+        return {"error": "Failed to retrieve data from the API"}
+    if not examples:
+        if not is_random:
+            return {"error": "No data found for the keyword", "permanent": True}
+        return {"error": "No sentences is found for this settings", "permanent": True}
+    if not is_random:
+        return examples[0]
+    return random.choice(examples)
+
+
+def build_response(example, with_context=True):
+    if with_context:
+        context = get_context(example["id"])
+    else:
+        context = {"prev": "", "next": "", "prev_furigana": "", "next_furigana": ""}
+    return {
+        "sentence": example["sentence"],
+        "sentence_with_furigana": example["sentence_with_furigana"],
+        "translation": example["translation"],
+        "deck_name": example["deck_name"],
+        "id": example["id"],
+        "audioURL": f"{api_url}/download_sentence_audio?id={example['id']}",
+        "imageURL": f"{api_url}/download_sentence_image?id={example['id']}",
+        "prev_text": context["prev"],
+        "next_text": context["next"],
+        "prev_text_furigana": context["prev_furigana"],
+        "next_text_furigana": context["next_furigana"]
+    }
+
+
+def api_lookup(keyword, min_length=12, selected_exact=False, is_random=False, with_context=True):
+    example = find_example(keyword, min_length, selected_exact, is_random)
+    if "error" in example:
+        return example
+    return build_response(example, with_context)
+
+
+def find_examples(keyword, selected, is_random=False):
+    keywords = split_keywords(keyword, selected.delimiter)
+    candidates = []
+    error = None
+    for part in keywords:
+        example = find_example(part, selected.min_length, selected.exact, is_random)
+        if "error" in example:
+            # A failed request is worth retrying even if another part of
+            # the keyword simply has no examples.
+            if error is None or (error.get("permanent") and not example.get("permanent")):
+                error = example
+            continue
+        covered = [other for other in keywords if other == part or other in example["sentence"]]
+        candidates.append((example, covered))
+    if not candidates:
+        return error
+
+    # Prefer examples that contain several of the keywords, then shorter
+    # ones, and keep an example only if it covers a keyword not yet covered.
+    candidates.sort(key=lambda candidate: (-len(candidate[1]), len(candidate[0]["sentence"])))
+    remaining = set(keywords)
+    examples = []
+    covered_keywords = []
+    for example, covered in candidates:
+        if remaining.intersection(covered):
+            remaining.difference_update(covered)
+            examples.append(example)
+            covered_keywords.append(covered)
+    return {"examples": examples, "keywords": covered_keywords}
+
+
+def build_responses(found, with_context=True):
+    if "error" in found:
+        return found
+    return {
+        "responses": [build_response(example, with_context) for example in found["examples"]],
+        "keywords": found["keywords"]
+    }
+
+
+def download_group_media(responses, media_dir, plan):
+    return [download_media(api_response, media_dir, plan) for api_response in responses["responses"]]
+
+
+def download_media(api_response, media_dir, plan):
+    audio_path = None
+    image_path = None
+    if plan.audio:
+        with stats.stage("audio") as sample:
+            audio_path = download_file(api_response["audioURL"], media_dir, media_file_name(api_response["id"], "mp3"), sample)
+    if plan.image:
+        with stats.stage("image") as sample:
+            image_path = download_image(api_response, media_dir, sample)
+    return audio_path, image_path
+
+
+def download_image(api_response, media_dir, sample):
+    file_name = media_file_name(api_response["id"], "png")
+    transcoder = image_transcoder
+    if transcoder is None:
+        return download_file(api_response["imageURL"], media_dir, file_name, sample)
+    target = os.path.join(media_dir, media_file_name(api_response["id"], transcoder.extension))
+    sample.cache_hit = os.path.exists(target)
+    if sample.cache_hit:
+        return target
+    return lookup_flight.do(target, fetch_image, api_response["imageURL"], os.path.join(media_dir, file_name), target, transcoder, sample)
+
+
+def fetch_image(url, png_path, target, transcoder, sample):
+    if os.path.exists(target):
+        return target
+    if os.path.exists(png_path):
+        # A full-size download from before the transcoder was turned on;
+        # older notes still point to it, so it is converted but kept.
+        source, downloaded = png_path, False
+    else:
+        # Downloaded under a name of its own, so a PNG target never has the
+        # same path as its source.
+        source, downloaded = os.path.join(os.path.dirname(png_path), "." + os.path.basename(png_path)), True
+        if fetch_file(url, source, sample) is None:
+            return None
+    try:
+        with stats.stage("transcode"):
+            return transcoder.transcode(source, target, remove_source=downloaded)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        if downloaded:
+            os.replace(source, png_path)
+        return png_path
+
+
+def update_note(field_values, api_response, selected, keyword, append_checkboxes, media, highlights=None):
+    update = NoteUpdate()
+    update.error = api_response.get("error")
+    update.permanent = api_response.get("permanent", False)
+    if update.error is None:
+        keywords = highlights or [keyword]
+        sentence = clean_sentence(api_response["sentence"])
+        sentence_with_furigana = clean_sentence(api_response["sentence_with_furigana"])
+        translation = api_response["translation"]
+        source = api_response["deck_name"]
+        _prev = api_response["prev_text"]
+        _next = api_response["next_text"]
+        _prev_furigana = api_response["prev_text_furigana"]
+        _next_furigana = api_response["next_text_furigana"]
+
+        audio_path, image_path = media
+
+        if audio_path:
+            update.set_field(field_values["Audio"], f'[sound:{os.path.basename(audio_path)}]', append_checkboxes["Audio"])
+
+        if image_path:
+            update.set_field(field_values["Image"], f'<img src="{os.path.basename(image_path)}">', append_checkboxes["Image"])
+
+        if selected.merge:
+            sentence = "<small>" + _prev + "</small><br><big> " + sentence + " </big><br><small>" + _next + "</small>"
+            sentence_with_furigana = "<small>" + _prev_furigana + "</small><br><big> " + sentence_with_furigana + " </big><br><small>" + _next_furigana + "</small>"
+        update.set_field(field_values["Sentence"], fix_sentence(sentence, keywords, selected.highlighting), append_checkboxes["Sentence"])
+        update.set_field(field_values["Sentence With Furigana"], fix_sentence(sentence_with_furigana, keywords, selected.highlighting), append_checkboxes["Sentence With Furigana"])
+        update.set_field(field_values["English Translation"], translation, append_checkboxes["English Translation"])
+        update.set_field(field_values["Source Media"], source, append_checkboxes["Source Media"])
+        update.set_field(field_values["Previous Sentence"], _prev, append_checkboxes["Previous Sentence"])
+        update.set_field(field_values["Next Sentence"], _next, append_checkboxes["Next Sentence"])
+        if selected.tag:
+            tag = source.replace(" ", "::")
+            update.add_tag(tag)
+        if selected.incremental:
+            update.fingerprint = fingerprint(keyword, selected, field_values, append_checkboxes)
+    return update
+
+
+def update_group(field_values, responses, selected, keyword, append_checkboxes, media):
+    if "error" in responses:
+        return update_note(field_values, responses, selected, keyword, append_checkboxes, (None, None))
+    updates = [
+        update_note(field_values, api_response, selected, keyword, append_checkboxes, paths, highlights)
+        for api_response, paths, highlights in zip(responses["responses"], media, responses["keywords"])
+    ]
+    if len(updates) == 1:
+        return updates[0]
+    return NoteUpdate.combine(updates)
+
+
+def process_group(keyword, field_values, selected, append_checkboxes, plan, media_dir):
+    responses = build_responses(find_examples(keyword, selected), plan.context)
+    media = []
+    if "error" not in responses:
+        media = download_group_media(responses, media_dir, plan)
+    with stats.stage("update"):
+        return update_group(field_values, responses, selected, keyword, append_checkboxes, media)
+
+
+def fetch_reroll_candidate(keyword, selected, plan, media_dir):
+    with stats.paused():
+        responses = build_responses(find_examples(keyword, selected, True), plan.context)
+        if "error" in responses:
+            return None
+        return responses, download_group_media(responses, media_dir, plan)
+
+
+def adopt_reroll_candidate(candidate, media_dir):
+    # Prefetched media waits outside the collection, so candidates that are
+    # never used do not end up in the media folder or on AnkiWeb.
+    responses, media = candidate
+    adopted = []
+    for paths in media:
+        moved = []
+        for path in paths:
+            if path is not None:
+                target = os.path.join(media_dir, os.path.basename(path))
+                if not os.path.exists(target):
+                    try:
+                        shutil.move(path, target)
+                    except OSError:
+                        # Discarded with another candidate for the same example.
+                        return None
+                path = target
+            moved.append(path)
+        adopted.append(tuple(moved))
+    return responses, adopted
+
+
+def discard_reroll_candidate(candidate):
+    _, media = candidate
+    for paths in media:
+        for path in paths:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def timed(fn, *args):
+    start = time.monotonic()
+    return fn(*args), time.monotonic() - start
+
+
+def run_threaded(groups, field_values, selected, append_checkboxes, plan, media_dir, workers, on_done, cancelled, window=64):
+    network.reset()
+    run_examples.clear()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    items = iter(groups.items())
+    pending = {}
+    try:
+        while True:
+            # Only a bounded window of groups is queued at a time, so cancel
+            # never has to wait for the rest of the selection to drain.
+            if not cancelled():
+                for keyword, nids in itertools.islice(items, max(window - len(pending), 0)):
+                    future = executor.submit(timed, process_group, keyword, field_values, selected, append_checkboxes, plan, media_dir)
+                    pending[future] = nids
+            if not pending:
+                break
+
+            # The timeout lets a cancel be noticed while every group in
+            # flight is still waiting on a slow server.
+            done, _ = concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                nids = pending.pop(future)
+                try:
+                    update, elapsed = future.result()
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+                    update, elapsed = None, None
+                on_done(nids, update, elapsed)
+            if cancelled():
+                network.cancel()
+                break
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # A cancelled batch would otherwise leave the shared client refusing
+        # requests, breaking rerolls until the next batch.
+        network.reset()
+
+
+def run_pipelined(groups, field_values, selected, append_checkboxes, plan, media_dir, workers, on_done, cancelled, window=64):
+    network.reset()
+    run_examples.clear()
+
+    def find(keyword):
+        return find_examples(keyword, selected)
+
+    def context(found):
+        return build_responses(found, plan.context)
+
+    def media(responses):
+        return download_group_media(responses, media_dir, plan)
+
+    def should_cancel():
+        if cancelled():
+            network.cancel()
+            return True
+        return False
+
+    def finish(nids, keyword, responses, paths, elapsed):
+        if pipeline.stopped():
+            return
+        try:
+            with stats.stage("update"):
+                update = update_group(field_values, responses, selected, keyword, append_checkboxes, paths)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            update = None
+        on_done(nids, update, elapsed)
+
+    lookup_workers, context_workers, media_workers = workers
+    pipeline = Pipeline(find, context, media, finish, lookup_workers, context_workers, media_workers, window, should_cancel)
+    try:
+        pipeline.run(groups.items())
+    finally:
+        network.reset()
+
+
+def fix_sentence(sentence, keywords, selected_highlighting):
+    if selected_highlighting:
+        return highlight(sentence, keywords)
+    return sentence
@@ -34,6 +34,16 @@ class Ui_Dialog(object):
         self.minLengthField.setMaximum(999)  # Set maximum value
         self.horizontalLayout_1.addWidget(self.minLengthField)
 
+        self.engineLabel = QtWidgets.QLabel(parent=Dialog)
+        self.engineLabel.setObjectName("engineLabel")
+        self.engineLabel.setText("Engine:")
+        self.horizontalLayout_1.addWidget(self.engineLabel)
+
+        self.engineField = QtWidgets.QComboBox(parent=Dialog)
+        self.engineField.setObjectName("engineField")
+        self.engineField.addItems(["Threads", "Asyncio"])
+        self.horizontalLayout_1.addWidget(self.engineField)
+
         # Add the horizontal layout to the main vertical layout
         self.verticalLayout.addLayout(self.horizontalLayout_1)
 
@@ -60,6 +70,11 @@ class Ui_Dialog(object):
         self.mergeCheckbox.setText("Merge with prev and next sentence")
         self.horizontalLayout_check.addWidget(self.mergeCheckbox)
 
+        self.incrementalCheckBox = QtWidgets.QCheckBox(parent=Dialog)
+        self.incrementalCheckBox.setObjectName("incrementalCheckBox")
+        self.incrementalCheckBox.setText("Skip Up-To-Date Notes")
+        self.horizontalLayout_check.addWidget(self.incrementalCheckBox)
+
         self.verticalLayout.addLayout(self.horizontalLayout_check)
 
         # Add line
@@ -99,3 +114,4 @@ class Ui_Dialog(object):
         self.label.setText(_translate("Dialog", "Source Field:"))
         self.pushButton.setText(_translate("Dialog", "Start"))
         self.minLengthLabel.setText(_translate("Dialog", "Min Char Length:"))
+        self.engineLabel.setText(_translate("Dialog", "Engine:"))
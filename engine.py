@@ -0,0 +1,188 @@
+import functools
+import json
+import os
+import threading
+
+from . import core, network
+from .batch import FetchPlan, NoteWriter, group_by_keyword, is_up_to_date, normalize_keyword
+from .core import SelectedSettings
+
+
+addon_dir = os.path.dirname(os.path.abspath(__file__))
+user_files = os.path.join(addon_dir, "user_files")
+
+
+def configure_network(config):
+    network.configure(
+        config.get("Workers", 8),
+        config.get("ConnectTimeout", 5),
+        config.get("ReadTimeout", 30),
+        config.get("MaxConnectionsPerHost", 8),
+        config.get("MaxRetries", 4)
+    )
+
+
+def configure_cache(config, folder=user_files):
+    return core.configure_cache(
+        os.path.join(folder, "lookup_cache.sqlite"),
+        config.get("CacheTTLHours", 168) * 3600,
+        config.get("CacheMaxEntries", 50000)
+    )
+
+
+def configure_images(config):
+    return core.configure_images(
+        config.get("ImageMaxSize", 0),
+        config.get("ImageFormat", "original"),
+        config.get("ImageQuality", 80),
+        config.get("ImageWorkers", 2)
+    )
+
+
+def index_path(folder=user_files):
+    return os.path.join(folder, "examples.sqlite")
+
+
+def configure_index(folder=user_files):
+    return core.configure_index(index_path(folder))
+
+
+def configure_fingerprints(folder=user_files):
+    return core.configure_fingerprints(os.path.join(folder, "fingerprints.sqlite"))
+
+
+def configure(config, folder=user_files):
+    cache = configure_cache(config, folder)
+    configure_index(folder)
+    configure_fingerprints(folder)
+    configure_images(config)
+    configure_network(config)
+    return cache
+
+
+@functools.lru_cache(maxsize=1)
+def search_query_names():
+    with open(os.path.join(addon_dir, 'fields.json'), 'r') as file:
+        fields_data = json.load(file)
+    return [query["Name"] for query in fields_data["Search Queries"]]
+
+
+def settings_from_config(config):
+    selected = SelectedSettings(
+        config.get("Source Field", "Front"),
+        config.get("MinURLLength", 12),
+        config.get("ExactSearch", False),
+        config.get("Highlighting", False),
+        config.get("Tag", False),
+        config.get("Merge", False),
+        config.get("Incremental", False),
+        config.get("Delimiter", "")
+    )
+
+    field_values = {}
+    append_checkboxes = {}
+
+    for i, name in enumerate(search_query_names()):
+        try:
+            fld = config["Search Queries"][i]["Field"]
+            append_checked = config["Search Queries"][i].get("Append", False)
+        except:
+            fld = ""
+            append_checked = False
+
+        field_values[name] = fld
+        append_checkboxes[name] = append_checked
+
+    return selected, field_values, append_checkboxes, FetchPlan(field_values, selected)
+
+
+class CompiledSettings:
+    def __init__(self, config):
+        self.config = config
+        self.selected, self.field_values, self.append_checkboxes, self.plan = settings_from_config(config)
+
+
+class Job:
+    def __init__(self, col, ids, selected, field_values, append_checkboxes, config, journal=None, on_progress=None, on_flush=None):
+        self.col = col
+        self.ids = ids
+        self.selected = selected
+        self.field_values = field_values
+        self.append_checkboxes = append_checkboxes
+        self.config = config
+        self.journal = journal
+        self.on_progress = on_progress
+        self.cancelled = threading.Event()
+        self.writer = NoteWriter(col, config.get("WriteChunkSize", 200), journal=journal, on_flush=on_flush, fingerprints=core.fingerprint_store)
+        self.skipped = []
+        self.failed = []
+        self.done = 0
+
+    def cancel(self):
+        self.cancelled.set()
+        # Aborts retry and backoff sleeps and slow reads right away instead
+        # of once the engine next looks at the flag.
+        network.cancel()
+
+    def progress(self, count):
+        self.done += count
+        if self.on_progress is not None:
+            self.on_progress(self.done)
+
+    def on_done(self, nids, update, elapsed):
+        if update is None or update.error:
+            self.failed.extend(nids)
+            if self.journal is not None:
+                if update is not None and update.permanent:
+                    self.journal.record(permanent=nids)
+                else:
+                    self.journal.record(failed=nids)
+        else:
+            self.writer.add(nids, update)
+        self.progress(len(nids))
+
+    def run(self):
+        selected = self.selected
+        config = self.config
+        keywords = []
+        missing = []
+        stored = {}
+        if selected.incremental and self.writer.fingerprints is not None:
+            stored = self.writer.fingerprints.get(self.col.path, self.ids)
+        for nid in self.ids:
+            note = self.col.get_note(nid)
+            if selected.source_field not in note:
+                missing.append(nid)
+                continue
+            keyword = note[selected.source_field]
+            if selected.incremental and is_up_to_date(note, stored.get(nid), normalize_keyword(keyword), selected, self.field_values, self.append_checkboxes):
+                self.skipped.append(nid)
+            else:
+                keywords.append((nid, keyword))
+        if self.skipped:
+            if self.journal is not None:
+                self.journal.record(completed=self.skipped)
+            self.progress(len(self.skipped))
+        if missing:
+            # Notes of a type without the source field have nothing to look up.
+            self.failed.extend(missing)
+            if self.journal is not None:
+                self.journal.record(permanent=missing)
+            self.progress(len(missing))
+
+        groups = group_by_keyword(keywords)
+        plan = FetchPlan(self.field_values, selected)
+        media_dir = self.col.media.dir()
+        window = config.get("SubmissionWindow", 64)
+        if config.get("Engine", "Threads") == "Asyncio":
+            workers = (
+                config.get("PipelineLookupWorkers", 4),
+                config.get("PipelineContextWorkers", 4),
+                config.get("PipelineMediaWorkers", 8)
+            )
+            core.run_pipelined(groups, self.field_values, selected, self.append_checkboxes, plan, media_dir, workers, self.on_done, self.cancelled.is_set, window)
+        else:
+            core.run_threaded(groups, self.field_values, selected, self.append_checkboxes, plan, media_dir, config.get("Workers", 8), self.on_done, self.cancelled.is_set, window)
+        self.writer.flush()
+        self.failed.extend(self.writer.failed)
+        return self
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+
+
+class FingerprintStore:
+    # Kept outside the notes so that thousands of distinct keywords do not
+    # turn into thousands of tags in the browser sidebar.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # The add-on folder is shared by every profile, so notes are keyed by
+        # their collection as well.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "collection TEXT NOT NULL, nid INTEGER NOT NULL, fingerprint TEXT NOT NULL, PRIMARY KEY (collection, nid))"
+        )
+        self._conn.commit()
+
+    def get(self, collection, nids):
+        nids = list(nids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(nids), 500):
+                chunk = nids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT nid, fingerprint FROM fingerprints WHERE collection = ? AND nid IN ({','.join('?' * len(chunk))})",
+                    [collection] + chunk
+                )
+                found.update(rows)
+        return found
+
+    def update(self, collection, fingerprints):
+        # A note written without a fingerprint loses its old one, so a later
+        # incremental run does not mistake it for up to date.
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (collection, nid, fingerprint) VALUES (?, ?, ?)",
+                [(collection, nid, value) for nid, value in fingerprints if value is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM fingerprints WHERE collection = ? AND nid = ?",
+                [(collection, nid) for nid, value in fingerprints if value is None]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
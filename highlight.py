@@ -0,0 +1,80 @@
+import functools
+import re
+
+
+cleanup_pattern = re.compile(r'[　→]')
+reading_pattern = re.compile(r' ?\[[^\]]*\]')
+kana = re.compile(r'[぀-ヿ]')
+# A one-kanji stem that follows another kanji is more likely part of a
+# compound, like 行 in 銀行から, than a conjugated verb.
+not_after_kanji = r'(?<![㐀-鿿々])'
+
+# Furigana sentences write readings as " 食[た]べる", so any character of a
+# keyword may be followed by a bracketed reading or preceded by a space.
+reading = r'(?:\[[^\]]*\])?'
+between = reading + ' ?'
+
+# The kana a dictionary-form ending can turn into when conjugated, so that
+# 飲む also matches 飲ん(だ), 飲み(ます) and 飲ま(ない).
+endings = {
+    "う": "わいうえおっ",
+    "く": "かきくけこい",
+    "ぐ": "がぎぐげごい",
+    "す": "さしすせそ",
+    "つ": "たちつてとっ",
+    "ぬ": "なにぬねのん",
+    "ぶ": "ばびぶべぼん",
+    "む": "まみむめもん",
+    "る": "らりるれろっ",
+    "い": "いかくけさ",
+}
+
+
+def clean_sentence(sentence):
+    return cleanup_pattern.sub('', sentence)
+
+
+def literal(text):
+    # The closing reading is included so the whole 学生[がくせい] ends up
+    # inside the <b> tag and the furigana filter still finds its base.
+    return between.join(re.escape(char) for char in text) + reading
+
+
+def keyword_pattern(keyword):
+    stem, ending = keyword[:-1], keyword[-1:]
+    # Only conjugate when the stem has a kanji in it; a bare kana stem such
+    # as い in いる would match almost anywhere.
+    if ending not in endings or not stem or not kana.sub('', stem):
+        return literal(keyword)
+    pattern = literal(stem) + " ?[" + endings[ending] + "]"
+    # Ichidan verbs (食べる → 食べた) drop the る entirely. A stem ending in a
+    # kanji is more likely godan (帰る), where 帰 alone would match 帰国.
+    if ending == "る" and kana.match(stem[-1]):
+        pattern += "?"
+    if len(stem) == 1:
+        # The dictionary form itself is still matched anywhere.
+        pattern = "(?:" + literal(keyword) + "|" + not_after_kanji + pattern + ")"
+    return pattern
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_highlighter(keywords):
+    keywords = sorted({reading_pattern.sub('', keyword) for keyword in keywords} - {""}, key=len, reverse=True)
+    if not keywords:
+        return None
+    # HTML tags are matched first and left alone, so a merged sentence with
+    # its <small>/<big> markup is highlighted in one pass.
+    return re.compile(r'(<[^>]*>)|(' + '|'.join(keyword_pattern(keyword) for keyword in keywords) + ')')
+
+
+def mark(match):
+    if match.group(1):
+        return match.group(1)
+    return f'<b>{match.group(2)}</b>'
+
+
+def highlight(text, keywords):
+    pattern = compile_highlighter(tuple(keywords))
+    if pattern is None:
+        return text
+    return pattern.sub(mark, text)
@@ -0,0 +1,74 @@
+import concurrent.futures
+import os
+import tempfile
+
+try:
+    from aqt.qt import QImage, Qt
+except ImportError:
+    QImage = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+formats = {"webp": "WEBP", "jpg": "JPEG", "png": "PNG"}
+
+
+def qt_transcode(source, target, max_size, image_format, quality):
+    image = QImage(source)
+    if image.isNull():
+        raise ValueError(f"Cannot read {source}")
+    if max_size and max(image.width(), image.height()) > max_size:
+        image = image.scaled(max_size, max_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    if image_format == "jpg" and image.hasAlphaChannel():
+        image = image.convertToFormat(QImage.Format.Format_RGB32)
+    if not image.save(target, formats[image_format], quality):
+        raise ValueError(f"Cannot write {formats[image_format]} images")
+
+
+def pillow_transcode(source, target, max_size, image_format, quality):
+    with Image.open(source) as image:
+        if max_size:
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if image_format == "jpg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(target, formats[image_format], quality=quality)
+
+
+class Transcoder:
+    def __init__(self, max_size=0, image_format="webp", quality=80, workers=2):
+        self.max_size = max_size
+        self.image_format = image_format
+        self.quality = quality
+        self.settings = (max_size, image_format, quality, workers)
+        # QImage and Pillow both release the GIL while decoding, scaling and
+        # encoding, so a small pool of their own keeps the CPU work off the
+        # network threads without needing separate processes.
+        self.backend = qt_transcode if QImage is not None else pillow_transcode
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def extension(self):
+        return self.image_format
+
+    def transcode(self, source, target, remove_source=True):
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix="." + self.extension, dir=os.path.dirname(target))
+        os.close(fd)
+        try:
+            self.executor.submit(self.backend, source, temp_path, self.max_size, self.image_format, self.quality).result()
+            os.replace(temp_path, target)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        if remove_source:
+            os.remove(source)
+        return target
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def available():
+    return QImage is not None or Image is not None
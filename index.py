@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+# Trigram FTS cannot match terms shorter than three characters; those fall
+# back to a substring scan in length order.
+min_fts_length = 3
+max_examples = 100
+
+
+def neighbor(record, key, side, field):
+    if side in record:
+        return record[side] or ""
+    sentences = record.get(key) or []
+    if not sentences:
+        return ""
+    sentence = sentences[-1] if key == "pretext_sentences" else sentences[0]
+    if isinstance(sentence, str):
+        return sentence if field == "sentence" else ""
+    return sentence.get(field, "")
+
+
+def dataset_row(record):
+    sentence = record["sentence"]
+    return (
+        str(record["id"]),
+        sentence,
+        record.get("sentence_with_furigana", record.get("furigana", sentence)),
+        record.get("translation", ""),
+        record.get("deck_name", record.get("deck", "")),
+        len(sentence),
+        neighbor(record, "pretext_sentences", "prev", "sentence"),
+        neighbor(record, "posttext_sentences", "next", "sentence"),
+        neighbor(record, "pretext_sentences", "prev_furigana", "sentence_with_furigana"),
+        neighbor(record, "posttext_sentences", "next_furigana", "sentence_with_furigana"),
+    )
+
+
+class ExampleIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS examples ("
+            "id TEXT PRIMARY KEY, sentence TEXT NOT NULL, sentence_with_furigana TEXT NOT NULL, "
+            "translation TEXT NOT NULL, deck_name TEXT NOT NULL, length INTEGER NOT NULL, "
+            "prev TEXT NOT NULL, next TEXT NOT NULL, prev_furigana TEXT NOT NULL, next_furigana TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS examples_length ON examples (length)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS examples_fts USING fts5("
+            "sentence, content='examples', tokenize='trigram')"
+        )
+        self._conn.commit()
+
+    def import_jsonl(self, path, batch_size=5000, on_progress=None):
+        count = 0
+        skipped = 0
+        rows = []
+        with self._lock:
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        rows.append(dataset_row(json.loads(line)))
+                    except (ValueError, KeyError, TypeError):
+                        skipped += 1
+                        continue
+                    if len(rows) >= batch_size:
+                        count += self._insert(rows)
+                        rows = []
+                        if on_progress is not None:
+                            on_progress(count)
+                count += self._insert(rows)
+            self._conn.execute("INSERT INTO examples_fts(examples_fts) VALUES('rebuild')")
+            self._conn.commit()
+        return count, skipped
+
+    def _insert(self, rows):
+        self._conn.executemany("INSERT OR REPLACE INTO examples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM examples").fetchone()[0]
+
+    def lookup(self, keyword, min_length=0):
+        columns = "e.id, e.sentence, e.sentence_with_furigana, e.translation, e.deck_name"
+        if len(keyword) >= min_fts_length:
+            query = (
+                f"SELECT {columns} FROM examples_fts JOIN examples e ON e.rowid = examples_fts.rowid "
+                "WHERE examples_fts MATCH ? AND e.length >= ? ORDER BY e.length, e.id LIMIT ?"
+            )
+            term = '"' + keyword.replace('"', '""') + '"'
+        else:
+            query = (
+                f"SELECT {columns} FROM examples e "
+                "WHERE instr(e.sentence, ?) > 0 AND e.length >= ? ORDER BY e.length, e.id LIMIT ?"
+            )
+            term = keyword
+        with self._lock:
+            rows = self._conn.execute(query, (term, min_length, max_examples)).fetchall()
+        return [
+            {"id": row[0], "sentence": row[1], "sentence_with_furigana": row[2], "translation": row[3], "deck_name": row[4]}
+            for row in rows
+        ]
+
+    def context(self, _id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT prev, next, prev_furigana, next_furigana FROM examples WHERE id = ?", (_id,)
+            ).fetchone()
+        if row is None or not (row[0] or row[1]):
+            return None
+        return {"prev": row[0], "next": row[1], "prev_furigana": row[2], "next_furigana": row[3]}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build an offline example index from an Immersion Kit JSONL dump.")
+    parser.add_argument("dataset")
+    parser.add_argument("index", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_files", "examples.sqlite"))
+    args = parser.parse_args()
+
+    index = ExampleIndex(args.index)
+    count, skipped = index.import_jsonl(args.dataset, on_progress=lambda n: print(f"{n} examples", flush=True))
+    print(f"Indexed {count} examples into {args.index} ({skipped} lines skipped)")
+    index.close()
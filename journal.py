@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+
+class Journal:
+    def __init__(self, path, settings, nids, completed=(), failed=(), permanent=()):
+        self.path = path
+        self.settings = settings
+        self.nids = list(nids)
+        self.completed = set(completed)
+        # Notes that failed in a way another run would not fix, such as a
+        # keyword with no examples, count as done so the job can finish.
+        self.permanent = set(permanent) - self.completed
+        self.failed = set(failed) - self.completed - self.permanent
+        self._file = None
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as file:
+                header = json.loads(file.readline())
+                completed = set()
+                failed = set()
+                permanent = set()
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash can leave the last line half written.
+                        break
+                    completed.update(record.get("completed", []))
+                    failed.update(record.get("failed", []))
+                    permanent.update(record.get("permanent", []))
+        except (OSError, ValueError):
+            return None
+        return cls(path, header["settings"], header["nids"], completed, failed, permanent)
+
+    @classmethod
+    def start(cls, path, settings, nids):
+        journal = cls(path, settings, nids)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"created": time.time(), "settings": settings, "nids": journal.nids}, file)
+            file.write("\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        return journal
+
+    def remaining(self):
+        return [nid for nid in self.nids if nid not in self.completed and nid not in self.permanent]
+
+    def record(self, completed=(), failed=(), permanent=()):
+        completed = list(completed)
+        failed = list(failed)
+        permanent = list(permanent)
+        self.completed.update(completed)
+        self.permanent.update(permanent)
+        self.failed.difference_update(completed)
+        self.failed.difference_update(permanent)
+        self.failed.update(failed)
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"completed": completed, "failed": failed, "permanent": permanent}) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        self.close()
+        if not self.remaining():
+            os.remove(self.path)
@@ -0,0 +1,84 @@
+import codecs
+import json
+import random
+import re
+
+
+decoder = json.JSONDecoder()
+whitespace = re.compile(r"[\s,]*")
+
+
+def iter_array(chunks, key):
+    # Yields the items of the first array stored under `key` while the body
+    # is still arriving, so callers can stop reading as soon as they have
+    # what they need.
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    marker = re.compile(r'(?<!\\)"' + re.escape(key) + r'"\s*:\s*\[')
+    buffer = ""
+    exhausted = False
+
+    def more():
+        nonlocal buffer, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += text.decode(b"", final=True)
+            exhausted = True
+        else:
+            buffer += text.decode(chunk)
+
+    while True:
+        match = marker.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        if exhausted:
+            return
+        # Keep enough of the tail to catch a marker split across chunks.
+        buffer = buffer[-(len(key) + 16):]
+        more()
+
+    while True:
+        pos = whitespace.match(buffer, pos).end()
+        if pos >= len(buffer):
+            if exhausted:
+                raise ValueError(f"Unterminated {key} array")
+            buffer = buffer[pos:]
+            pos = 0
+            more()
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if exhausted:
+                raise
+            buffer = buffer[pos:]
+            pos = 0
+            more()
+            continue
+        yield item
+        buffer = buffer[end:]
+        pos = 0
+
+
+def first(items, count=1):
+    result = []
+    for item in items:
+        result.append(item)
+        if len(result) >= count:
+            break
+    return result
+
+
+def reservoir(items, size):
+    sample = []
+    for i, item in enumerate(items):
+        if i < size:
+            sample.append(item)
+        else:
+            j = random.randint(0, i)
+            if j < size:
+                sample[j] = item
+    return sample
@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Cancelled(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    def __init__(self, max_limit=8, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.short_latency = None
+        self.long_latency = None
+        self._since_change = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, ok=True):
+        with self._cond:
+            self.in_flight -= 1
+            self._since_change += 1
+            if not ok:
+                self._decrease(0.7)
+            elif latency is not None:
+                self._observe(latency)
+            self._cond.notify_all()
+
+    def _decrease(self, factor):
+        # Requests that were already in flight report the same congestion,
+        # so back off at most once per window of completions.
+        if self._since_change >= self.limit:
+            self.limit = max(self.min_limit, self.limit * factor)
+            self._since_change = 0
+
+    def _observe(self, latency):
+        # AIMD on latency: grow by one request per window while recent
+        # responses keep up with the long-run average, back off once they
+        # start queueing behind each other.
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+        self.short_latency = 0.8 * self.short_latency + 0.2 * latency
+        self.long_latency = 0.98 * self.long_latency + 0.02 * latency
+        if self.short_latency > 1.5 * self.long_latency + 0.05:
+            self._decrease(0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    def __init__(self, workers=8, connect_timeout=5, read_timeout=30, per_host=8, retries=4, backoff=0.5, max_backoff=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # pool_block keeps the pool from opening throwaway connections past
+        # its size when more threads than expected share it.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, per_host), pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self._open = set()
+        self._open_lock = threading.Lock()
+
+    def host_limiter(self, url):
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                limiter = self._hosts[host] = AdaptiveLimiter(self.per_host)
+            return limiter
+
+    def delay(self, attempt, response=None):
+        delay = retry_after(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+        return min(max(delay, 0), self.max_backoff)
+
+    def wait(self, delay):
+        if self.cancelled.wait(delay):
+            raise Cancelled("Cancelled")
+
+    @contextmanager
+    def get(self, url, stream=False):
+        limiter = self.host_limiter(url)
+        attempt = 0
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled("Cancelled")
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                limiter.release(ok=False)
+                if attempt >= self.retries:
+                    raise
+                self.wait(self.delay(attempt))
+                attempt += 1
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                limiter.release(ok=False)
+                delay = self.delay(attempt, response)
+                response.close()
+                self.wait(delay)
+                attempt += 1
+                continue
+            break
+
+        latency = time.monotonic() - start
+        ok = response.status_code not in RETRY_STATUSES
+        with self._open_lock:
+            self._open.add(response)
+        try:
+            yield response
+        except Exception:
+            if self.cancelled.is_set():
+                raise Cancelled("Cancelled")
+            raise
+        finally:
+            with self._open_lock:
+                self._open.discard(response)
+            response.close()
+            limiter.release(latency, ok)
+
+    def cancel(self):
+        self.cancelled.set()
+        # Closing the sockets makes reads that are blocked on a slow body
+        # fail now instead of at the read timeout.
+        with self._open_lock:
+            responses = list(self._open)
+        for response in responses:
+            response.close()
+
+    def reset(self):
+        self.cancelled.clear()
+
+    def close(self):
+        self.session.close()
+
+
+client = None
+client_settings = None
+client_lock = threading.Lock()
+
+
+def configure(workers=8, connect_timeout=5, read_timeout=30, per_host=8, retries=4):
+    global client, client_settings
+    settings = (workers, connect_timeout, read_timeout, per_host, retries)
+    with client_lock:
+        # Requests already in flight keep using the old client, so it is
+        # left for the garbage collector instead of being closed here.
+        if client is None or settings != client_settings:
+            client = HttpClient(*settings)
+            client_settings = settings
+        return client
+
+
+def get_client():
+    with client_lock:
+        current = client
+    return current or configure()
+
+
+def get(url, stream=False):
+    return get_client().get(url, stream)
+
+
+def cancel():
+    get_client().cancel()
+
+
+def reset():
+    get_client().reset()
+
+
+def is_cancelled():
+    return get_client().cancelled.is_set()
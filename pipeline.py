@@ -0,0 +1,107 @@
+import asyncio
+import concurrent.futures
+import time
+
+
+DONE = object()
+
+
+class Pipeline:
+    def __init__(self, find, context, media, finish, lookup_workers=4, context_workers=4, media_workers=8, queue_size=32, should_cancel=None):
+        self.find = find
+        self.context = context
+        self.media = media
+        self.finish = finish
+        self.lookup_workers = lookup_workers
+        self.context_workers = context_workers
+        self.media_workers = media_workers
+        self.queue_size = queue_size
+        self.should_cancel = should_cancel
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stopped(self):
+        if not self.cancelled and self.should_cancel is not None and self.should_cancel():
+            self.cancel()
+        return self.cancelled
+
+    def run(self, groups):
+        workers = self.lookup_workers + self.context_workers + self.media_workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            asyncio.run(self._run(groups, executor))
+
+    async def _run(self, groups, executor):
+        loop = asyncio.get_running_loop()
+        found = asyncio.Queue(self.queue_size)
+        responses = asyncio.Queue(self.queue_size)
+        lookups = asyncio.Queue(self.queue_size)
+
+        def blocking(fn, *args):
+            return loop.run_in_executor(executor, fn, *args)
+
+        async def lookup(item):
+            keyword, nids = item
+            start = time.monotonic()
+            try:
+                example = await blocking(self.find, keyword)
+            except Exception as e:
+                example = {"error": str(e)}
+            await found.put((keyword, nids, example, start))
+
+        async def context(item):
+            keyword, nids, example, start = item
+            if "error" in example:
+                api_response = example
+            else:
+                try:
+                    api_response = await blocking(self.context, example)
+                except Exception as e:
+                    api_response = {"error": str(e)}
+            await responses.put((keyword, nids, api_response, start))
+
+        async def media(item):
+            keyword, nids, api_response, start = item
+            paths = []
+            if "error" not in api_response:
+                # A failed download still leaves the text to write.
+                paths = [(None, None)] * len(api_response["responses"])
+                try:
+                    paths = await blocking(self.media, api_response)
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+            self.finish(nids, keyword, api_response, paths, time.monotonic() - start)
+
+        async def feed():
+            for group in groups:
+                if self.stopped():
+                    break
+                await lookups.put(group)
+
+        await asyncio.gather(
+            self._stage(feed(), lookups, self.lookup_workers),
+            self._stage(self._drain(lookups, lookup, self.lookup_workers), found, self.context_workers),
+            self._stage(self._drain(found, context, self.context_workers), responses, self.media_workers),
+            self._drain(responses, media, self.media_workers),
+        )
+
+    async def _stage(self, work, outbox, consumers):
+        await work
+        for _ in range(consumers):
+            await outbox.put(DONE)
+
+    async def _drain(self, inbox, handle, workers):
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is DONE:
+                    return
+                if self.stopped():
+                    continue
+                try:
+                    await handle(item)
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
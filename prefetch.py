@@ -0,0 +1,82 @@
+import concurrent.futures
+import threading
+from collections import OrderedDict, deque
+
+
+class Prefetcher:
+    def __init__(self, fetch, depth=2, max_notes=8, workers=2, discard=None):
+        self.fetch = fetch
+        self.discard = discard
+        self.depth = depth
+        self.max_notes = max_notes
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._ready = OrderedDict()
+        self._pending = {}
+
+    def want(self, key, *args):
+        evicted = []
+        with self._lock:
+            ready = self._ready.setdefault(key, deque())
+            self._ready.move_to_end(key)
+            missing = self.depth - len(ready) - self._pending.get(key, 0)
+            for _ in range(max(missing, 0)):
+                self._pending[key] = self._pending.get(key, 0) + 1
+                self._executor.submit(self._run, key, args)
+            while len(self._ready) > self.max_notes:
+                evicted.extend(self._ready.popitem(last=False)[1])
+        self._discard(evicted)
+
+    def take(self, key, *args):
+        with self._lock:
+            ready = self._ready.get(key)
+            candidate = ready.popleft() if ready else None
+        self.want(key, *args)
+        return candidate
+
+    def keep(self, keys):
+        keys = set(keys)
+        evicted = []
+        with self._lock:
+            for key in list(self._ready):
+                if key not in keys:
+                    evicted.extend(self._ready.pop(key))
+        self._discard(evicted)
+
+    def clear(self):
+        with self._lock:
+            evicted = [candidate for ready in self._ready.values() for candidate in ready]
+            self._ready.clear()
+        self._discard(evicted)
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, key, args):
+        try:
+            candidate = self.fetch(*args)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            candidate = None
+        with self._lock:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+            # The key may have been evicted while the fetch was running.
+            ready = self._ready.get(key)
+            if candidate is not None and ready is not None:
+                ready.append(candidate)
+                candidate = None
+        if candidate is not None:
+            self._discard([candidate])
+
+    def _discard(self, candidates):
+        # Candidates that are never taken still own files on disk.
+        if self.discard is None:
+            return
+        for candidate in candidates:
+            try:
+                self.discard(candidate)
+            except Exception as e:
+                print(f"An error occurred: {e}")
@@ -0,0 +1,150 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def bucket_label(ms):
+    for bound in BUCKETS_MS:
+        if ms < bound:
+            return f"<{bound}ms"
+    return f">={BUCKETS_MS[-1]}ms"
+
+
+class Sample:
+    def __init__(self):
+        self.bytes = 0
+        self.cache_hit = None
+        self.error = False
+
+
+class StageStats:
+    def __init__(self):
+        self.durations = []
+        self.bytes = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, seconds, sample):
+        self.durations.append(seconds)
+        self.bytes += sample.bytes
+        self.errors += sample.error
+        if sample.cache_hit is True:
+            self.cache_hits += 1
+        elif sample.cache_hit is False:
+            self.cache_misses += 1
+
+    def summary(self):
+        durations = sorted(self.durations)
+        count = len(durations)
+
+        def percentile(fraction):
+            return round(durations[min(count - 1, int(fraction * count))] * 1000, 1) if count else 0.0
+
+        histogram = {bucket_label(bound - 1): 0 for bound in BUCKETS_MS}
+        histogram[bucket_label(BUCKETS_MS[-1])] = 0
+        for seconds in durations:
+            histogram[bucket_label(seconds * 1000)] += 1
+
+        return {
+            "count": count,
+            "errors": self.errors,
+            "total_s": round(sum(durations), 3),
+            "mean_ms": round(sum(durations) / count * 1000, 1) if count else 0.0,
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(durations[-1] * 1000, 1) if count else 0.0,
+            "bytes": self.bytes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "histogram": histogram,
+        }
+
+
+class RunStats:
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        sample = Sample()
+        start = time.monotonic()
+        try:
+            yield sample
+        except BaseException:
+            sample.error = True
+            raise
+        finally:
+            self.record(name, time.monotonic() - start, sample)
+
+    def record(self, name, seconds, sample):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = StageStats()
+            stage.add(seconds, sample)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        with self._lock:
+            stages = {name: stage.summary() for name, stage in self.stages.items()}
+        end = self.finished or time.time()
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_s": round(end - self.started, 3),
+            "stages": stages,
+        }
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"Wall time: {summary['wall_s']:.1f}s", ""]
+        lines.append(f"{'stage':<10}{'count':>7}{'errors':>8}{'total s':>9}{'p50 ms':>9}{'p99 ms':>9}{'MB':>8}{'hits':>7}")
+        for name, stage in summary["stages"].items():
+            lines.append(
+                f"{name:<10}{stage['count']:>7}{stage['errors']:>8}{stage['total_s']:>9.1f}"
+                f"{stage['p50_ms']:>9.0f}{stage['p99_ms']:>9.0f}{stage['bytes'] / 2 ** 20:>8.1f}{stage['cache_hits']:>7}"
+            )
+        return "\n".join(lines)
+
+
+current = None
+local = threading.local()
+
+
+@contextmanager
+def unrecorded():
+    yield Sample()
+
+
+@contextmanager
+def paused():
+    # Rerolls and their prefetches run alongside batches; recording them
+    # would inflate the batch's report, and between batches nothing would
+    # ever read what they add.
+    local.paused = True
+    try:
+        yield
+    finally:
+        local.paused = False
+
+
+def stage(name):
+    run = current
+    if run is None or run.finished is not None or getattr(local, "paused", False):
+        return unrecorded()
+    return run.stage(name)
+
+
+def start_run():
+    global current
+    current = RunStats()
+    return current